@@ -1,9 +1,24 @@
 import logging
+import logging.handlers
+import queue
 import os
+import re
+import shutil
+import tempfile
+import threading
 import asyncio
+import weakref
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 import yt_dlp as youtube_dl
+from yt_dlp.utils import DownloadError, RejectedVideoReached, match_filter_func
+from cachetools import TTLCache
+import aiofiles
+import aiofiles.os as aos
 from typing import Optional, Dict, List, Any
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -14,22 +29,123 @@ from telegram.ext import (
     ContextTypes
 )
 
+try:
+    import uvloop  # : event loop  libuv
+except ImportError:
+    uvloop = None
+
+try:
+    import orjson  # :   JSON- Bot API
+except ImportError:
+    orjson = None
+
 #  (    production!)
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN', '  ')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  #    webhook,   - polling
+PORT = int(os.getenv('PORT', 8443))
 TELEGRAM_MAX_SIZE = 50 * 1024 * 1024  # 50MB -  Telegram
 COMPRESSED_QUALITY = '480p'  #   
 MAX_DURATION = 15 * 60  # 15  
+INFO_CACHE_TTL = 10 * 60  #    
+SESSION_TTL = 60 * 60  #    
+CACHE_MAX_SIZE = 1_000  #        (  )
+CACHE_GC_INTERVAL = 5 * 60  #     
+YDL_WORKERS = int(os.getenv('YDL_WORKERS', 4))  #    
+YTDLP_CACHE = os.getenv('YTDLP_CACHE')  #  player JS/ (  $XDG_CACHE_HOME/yt-dlp)
+YTDLP_PLAYER_CLIENTS = os.getenv('YTDLP_PLAYER_CLIENTS')  #  YouTube  , . ios,web
+YDL_FRAGMENTS = int(os.getenv('YDL_FRAGMENTS', 4))  #   DASH/HLS
+MAX_ACTIVE_REQUESTS = 8  #  +   
+MAX_PARALLEL_DOWNLOADS = 4  #   ( ),   
+MAX_PARALLEL_UPLOADS = 2  #    Telegram (    )
+UPLOAD_TIMEOUT = 600  #   , 
+TELEGRAM_POOL_SIZE = 256  #   Bot API (   )
+#  info,    process_ie_result; ,   
+#          
+_INFO_KEYS = frozenset({
+    '_type', '_probe', 'id', 'title', 'ext', 'url', 'formats', 'duration', 'is_live',
+    'extractor', 'extractor_key', 'webpage_url', 'webpage_url_basename',
+    'webpage_url_domain', 'original_url', 'http_headers', 'cookies', '_format_sort_fields'
+})
+_URL_RE = re.compile(r'(?:youtube\.com|youtu\.be|instagram\.com|tiktok\.com)', re.IGNORECASE)
 
-#  
+#  :      ,
+#  stderr    QueueListener
+_log_queue: queue.Queue = queue.Queue(-1)
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+    level=logging.INFO,
+    handlers=[logging.handlers.QueueHandler(_log_queue)]
 )
 logger = logging.getLogger(__name__)
 
+class OrjsonRequest(HTTPXRequest):
+    """HTTPXRequest,   Telegram  orjson"""
+
+    @staticmethod
+    def parse_json_payload(payload: bytes) -> Dict[str, Any]:
+        if orjson is None:
+            return HTTPXRequest.parse_json_payload(payload)
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError as exc:
+            raise TelegramError("Invalid server response") from exc
+
 class VideoDownloaderBot:
+    #   PTB 20 ,      
+    _BEST_BUTTON = InlineKeyboardButton(
+        "?  ", 
+        callback_data="quality_best"
+    )
+
     def __init__(self):
-        self.user_data: Dict[int, Dict[str, Any]] = {}
+        #       ,     
+        self.user_data: TTLCache = TTLCache(maxsize=CACHE_MAX_SIZE, ttl=SESSION_TTL)
+        self._info_cache: TTLCache = TTLCache(maxsize=CACHE_MAX_SIZE, ttl=INFO_CACHE_TTL)
+        # yt-dlp ,     event loop.  
+        #   ,       
+        self._executor = ThreadPoolExecutor(max_workers=YDL_WORKERS)
+        self._download_executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_DOWNLOADS)
+        self._upload_sem = asyncio.Semaphore(MAX_PARALLEL_UPLOADS)
+        self._global_sem = asyncio.Semaphore(MAX_ACTIVE_REQUESTS)
+        #   ,        
+        self._user_sems: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+        #   yt-dlp;  YoutubeDL     
+        self._ydl_opts: Dict[str, Dict[str, Any]] = {
+            #    //format_id,  
+            #       DASH-
+            'probe': {
+                'quiet': True,
+                'no_warnings': True,
+                'extract_flat': 'in_playlist',
+                'skip_download': True,
+                'youtube_include_dash_manifest': False,
+                'extractor_args': {'youtube': {'player_skip': ['js', 'configs', 'webpage']}}
+            },
+            'info': {'quiet': True, 'no_warnings': True},
+            'download': {
+                'outtmpl': '%(id)s.%(ext)s',
+                'quiet': True,
+                'max_filesize': TELEGRAM_MAX_SIZE,
+                'concurrent_fragment_downloads': YDL_FRAGMENTS
+            }
+        }
+        #      yt-dlp:   $XDG_CACHE_HOME
+        #  ,    
+        for opts in self._ydl_opts.values():
+            if YTDLP_CACHE:
+                opts['cachedir'] = YTDLP_CACHE
+            if YTDLP_PLAYER_CLIENTS:
+                youtube_args = opts.setdefault('extractor_args', {}).setdefault('youtube', {})
+                youtube_args['player_client'] = YTDLP_PLAYER_CLIENTS.split(',')
+        #        ; 
+        #  , ..      
+        for kind in ('probe', 'info'):
+            self._ydl_opts[kind].update({
+                'match_filter': match_filter_func(f'duration <=? {MAX_DURATION}'),
+                'break_on_reject': True
+            })
+        self._ydl_local = threading.local()
         self.app = None
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -44,78 +160,154 @@ class VideoDownloaderBot:
 
     def get_quality_keyboard(self, formats: List[Dict[str, Any]]) -> InlineKeyboardMarkup:
         """   """
-        buttons = []
-        for fmt in formats[:5]:
-            res = fmt.get('height', '?')
-            ext = fmt.get('ext', 'mp4')
-            buttons.append([InlineKeyboardButton(
-                f"{res}p ({ext})", 
-                callback_data=f"quality_{fmt['format_id']}"
-            )])
-        buttons.append([InlineKeyboardButton(
-            "?  ", 
-            callback_data="quality_best"
-        )])
-        return InlineKeyboardMarkup(buttons)
+        rows = tuple(
+            (InlineKeyboardButton(
+                f"{fmt.get('height', '?')}p ({fmt.get('ext', 'mp4')})",
+                callback_data="quality_" + fmt['format_id']
+            ),)
+            for fmt in formats[:5]
+        )
+        return InlineKeyboardMarkup(rows + ((self._BEST_BUTTON,),))
 
     async def get_video_info(self, url: str) -> Optional[Dict[str, Any]]:
         """   """
-        ydl_opts = {'quiet': True, 'no_warnings': True}
+        cached = self._info_cache.get(url)
+        if cached:
+            return cached
+
+        loop = asyncio.get_running_loop()
         try:
-            with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-                return ydl.extract_info(url, download=False)
+            info = await loop.run_in_executor(self._executor, self._extract_info, url)
+        except RejectedVideoReached:
+            raise
         except Exception as e:
             logger.error(f"Video info error: {e}")
             return None
 
+        self._info_cache[url] = info
+        return info
+
+    def _extract_info(self, url: str) -> Optional[Dict[str, Any]]:
+        """  (   )"""
+        #      , yt-dlp  DownloadError
+        # ("No video formats found!"); RejectedVideoReached  DownloadError   
+        try:
+            info = self._get_ydl('probe').extract_info(url, download=False)
+        except DownloadError:
+            info = None
+        if not info or not info.get('formats'):
+            info = self._get_ydl('info').extract_info(url, download=False)
+        else:
+            #  YouTube  player JS    ,  
+            # :      
+            info['_probe'] = info.get('extractor_key') == 'Youtube'
+        return info and {k: v for k, v in info.items() if k in _INFO_KEYS}
+
+    def _get_ydl(self, kind: str) -> youtube_dl.YoutubeDL:
+        """YoutubeDL  :      """
+        ydl = getattr(self._ydl_local, kind, None)
+        if ydl is None:
+            ydl = youtube_dl.YoutubeDL(self._ydl_opts[kind])
+            setattr(self._ydl_local, kind, ydl)
+        return ydl
+
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """   """
         text = update.message.text.strip()
         user_id = update.message.from_user.id
         
-        if not any(d in text for d in ['youtube.com', 'youtu.be', 'instagram.com', 'tiktok.com']):
+        if not _URL_RE.search(text):
             await update.message.reply_text("     YouTube, Instagram  TikTok")
             return
 
         await update.message.reply_text("??  ...")
-        info = await self.get_video_info(text)
+        try:
+            info = await self.get_video_info(text)
+        except RejectedVideoReached:
+            await update.message.reply_text("?    (. 15 )")
+            return
         
         if not info:
             await update.message.reply_text("?      ")
             return
 
+        if info.get('is_live'):
+            await update.message.reply_text("?    ")
+            return
+
         formats = info.get('formats', [])
-        video_formats = [f for f in formats if f.get('vcodec') != 'none']
+        #  :  ,     Telegram,   
+        #   ( -   yt-dlp), 5   
+        video_formats = sorted(
+            {
+                f['height']: f for f in formats
+                if f.get('vcodec') != 'none' and f.get('height')
+                and (f.get('filesize') or 0) <= TELEGRAM_MAX_SIZE
+            }.values(),
+            key=itemgetter('height'),
+            reverse=True
+        )[:5]
         
         if not video_formats:
             await update.message.reply_text("?    ")
             return
 
-        self.user_data[user_id] = {'url': text}
+        self.user_data[user_id] = {'info': info}
         await update.message.reply_text(
             " :",
             reply_markup=self.get_quality_keyboard(video_formats)
         )
 
-    async def download_video(self, url: str, quality: str) -> Optional[str]:
-        """    """
-        ydl_opts = {
-            'format': quality,
-            'outtmpl': 'video.%(ext)s',
-            'quiet': True,
-            'max_filesize': TELEGRAM_MAX_SIZE
-        }
-        
+    async def download_video(self, info: Dict[str, Any],
+                             fmt: Optional[Dict[str, Any]]) -> Optional[str]:
+        """     (None - )"""
+        loop = asyncio.get_running_loop()
         try:
-            with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-                for f in os.listdir():
-                    if f.startswith('video.'):
-                        return f
+            return await loop.run_in_executor(self._download_executor, self._download, info, fmt)
         except Exception as e:
             logger.error(f"Download error: {e}")
         return None
 
+    def _download(self, info: Dict[str, Any], fmt: Optional[Dict[str, Any]]) -> Optional[str]:
+        """  (   )"""
+        #     info['formats'],      
+        if fmt is None:
+            format_spec = 'best'
+        elif fmt.get('acodec') == 'none':
+            format_spec = fmt['format_id'] + '+bestaudio/best'
+        else:
+            format_spec = fmt['format_id']
+
+        #     :      
+        tmpdir = tempfile.mkdtemp(prefix='vdl_')
+        ydl = self._get_ydl('download')
+        ydl.params['paths'] = {'home': tmpdir}
+        ydl.params['format'] = format_spec
+        ydl.format_selector = ydl.build_format_selector(format_spec)
+        
+        try:
+            if info.get('_probe'):
+                #    player JS; format_id (itag)   
+                info = self._get_ydl('info').extract_info(
+                    info.get('original_url') or info['webpage_url'], download=False, process=False
+                )
+            #         .
+            # process_video_result   ,       
+            info = dict(info)
+            if info.get('formats'):
+                info['formats'] = [dict(f) for f in info['formats']]
+            result = ydl.process_ie_result(info, download=True)
+        except Exception:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            raise
+
+        downloads = result.get('requested_downloads') or [{}]
+        path = downloads[0].get('filepath')
+        if path and os.path.exists(path):
+            return path
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        return None
+
     async def quality_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """  """
         query = update.callback_query
@@ -123,36 +315,69 @@ class VideoDownloaderBot:
         
         quality = query.data.replace('quality_', '')
         user_id = query.from_user.id
-        url = self.user_data.get(user_id, {}).get('url')
+        info = self.user_data.get(user_id, {}).get('info')
+        
+        fmt = None
+        if info and quality != 'best':
+            fmt = next((f for f in info.get('formats', []) if f.get('format_id') == quality), None)
         
-        if not url:
+        if not info or (quality != 'best' and fmt is None):
             await query.edit_message_text("?  ,   ")
             return
 
         await query.edit_message_text("?  ...")
         
+        #      ,     
+        user_sem = self._user_sems.get(user_id)
+        if user_sem is None:
+            user_sem = self._user_sems[user_id] = asyncio.Semaphore(1)
+        async with user_sem, self._global_sem:
+            await self._download_and_send(query, context, info, fmt)
+
+    async def _download_and_send(self, query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE,
+                                 info: Dict[str, Any], fmt: Optional[Dict[str, Any]]) -> None:
+        """     """
+        video_path = None
         try:
-            video_path = await self.download_video(url, 'best' if quality == 'best' else quality)
+            video_path = await self.download_video(info, fmt)
             if not video_path:
                 await query.edit_message_text("?  ")
                 return
 
-            if os.path.getsize(video_path) > TELEGRAM_MAX_SIZE:
+            #     ,    event loop
+            if (await aos.stat(video_path)).st_size > TELEGRAM_MAX_SIZE:
                 await query.edit_message_text("?    (. 50MB)")
-                os.remove(video_path)
                 return
 
-            with open(video_path, 'rb') as video_file:
+            # InputFile  PTB 20   ,  
+            #   ,    
+            async with self._upload_sem:
+                async with aiofiles.open(video_path, 'rb') as video_file:
+                    video_data = await video_file.read()
                 await context.bot.send_video(
                     chat_id=query.message.chat_id,
-                    video=video_file,
-                    supports_streaming=True
+                    video=video_data,
+                    filename=os.path.basename(video_path),
+                    supports_streaming=True,
+                    read_timeout=UPLOAD_TIMEOUT,
+                    write_timeout=UPLOAD_TIMEOUT
                 )
-            os.remove(video_path)
             
         except Exception as e:
             logger.error(f"Error: {e}")
             await query.edit_message_text("?  ")
+        finally:
+            if video_path:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, shutil.rmtree, os.path.dirname(video_path), True
+                )
+
+    async def _gc(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """  """
+        # TTLCache     ,   
+        #   info-    
+        self.user_data.expire()
+        self._info_cache.expire()
 
     async def error_handler(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
         """  """
@@ -160,7 +385,16 @@ class VideoDownloaderBot:
 
     def run(self):
         """ """
-        self.app = Application.builder().token(TELEGRAM_TOKEN).build()
+        _log_listener.start()
+        #   ,   
+        self.app = (
+            Application.builder()
+            .token(TELEGRAM_TOKEN)
+            .request(OrjsonRequest(connection_pool_size=TELEGRAM_POOL_SIZE))
+            .get_updates_request(OrjsonRequest())
+            .concurrent_updates(True)
+            .build()
+        )
         
         #  
         handlers = [
@@ -173,11 +407,33 @@ class VideoDownloaderBot:
             self.app.add_handler(handler)
         
         self.app.add_error_handler(self.error_handler)
+        if self.app.job_queue:
+            self.app.job_queue.run_repeating(self._gc, interval=CACHE_GC_INTERVAL)
+        else:
+            logger.warning("JobQueue ,  python-telegram-bot[job-queue]")
         
         #  
         logger.info(" ")
-        self.app.run_polling()
+        try:
+            if WEBHOOK_URL:
+                self.app.run_webhook(
+                    listen='0.0.0.0',
+                    port=PORT,
+                    url_path=TELEGRAM_TOKEN,
+                    webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{TELEGRAM_TOKEN}"
+                )
+            else:
+                self.app.run_polling()
+        finally:
+            #     ,       
+            self._executor.shutdown(wait=False)
+            self._download_executor.shutdown(wait=False)
+            _log_listener.stop()
 
 if __name__ == '__main__':
+    #     :  Python 3.9   __init__
+    #    loop  
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     bot = VideoDownloaderBot()
     bot.run()
\ No newline at end of file